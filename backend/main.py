@@ -1,16 +1,28 @@
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import asynccontextmanager
+import aiosqlite
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import uuid
 import json
 import sqlite3
 import hashlib
+import hmac
+import gzip
 import os
+import time
+import math
 import binascii
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # --- IMPORT SOLVER ---
 # Ensure you have the 'solver.py' file in the same directory.
@@ -23,75 +35,286 @@ except ImportError:
         def solve_route(self, vehicles, orders):
             return {}, 0
             
-print("\n" + "="*50)
-print("✅ LOADING: FRESQ LOGISTICS ENGINE v3.1 (FINAL)")
-print("⚠️  NOTE: If DB schema errors occur, delete 'fresq.db' to reset.")
-print("="*50 + "\n")
+# --- JSON ENCODING ---
+# orjson is optional: it writes bytes directly and is several times faster than
+# the stdlib encoder on large order lists.
+try:
+    import orjson
+    def dump_json(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def dump_json(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+# --- CONDITIONAL RESPONSES ---
+# Bodies served with an ETag are gzipped here rather than by GZipMiddleware, so
+# each encoding carries its own strong ETag and a 304 never validates the other.
+def encode_body(raw: bytes, compresslevel: int = 9) -> Dict[str, Any]:
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    return {
+        "raw": raw,
+        "gzip": gzip.compress(raw, compresslevel=compresslevel),
+        "etag": '"' + digest + '"',
+        "etag_gzip": '"' + digest + '-gz"',
+    }
+
+def encoded_response(request: Request, encoded: Dict[str, Any], media_type: str, cache_control: str) -> Response:
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = encoded["etag_gzip"] if use_gzip else encoded["etag"]
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(encoded["gzip"], media_type=media_type, headers=headers)
+    return Response(encoded["raw"], media_type=media_type, headers=headers)
+
+DB_NAME = "fresq.db"
 
-app = FastAPI()
+# Applied to every connection: WAL lets heartbeat writes and dispatch reads overlap,
+# synchronous=NORMAL drops the per-commit fsync of the rollback journal.
+SQLITE_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-65536;
+"""
+
+# Connections are opened (and PRAGMA'd) once at startup and handed out per request.
+# Each aiosqlite connection runs on its own thread, so WAL readers proceed in parallel.
+DB_POOL_SIZE = 4
+DB_POOL: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+
+@asynccontextmanager
+async def get_conn():
+    conn = await DB_POOL.get()
+    try:
+        yield conn
+    finally:
+        # Never hand the next borrower a half-finished write (e.g. after an error)
+        if conn.in_transaction:
+            await conn.rollback()
+        DB_POOL.put_nowait(conn)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print("\n" + "="*50)
+    print("✅ LOADING: FRESQ LOGISTICS ENGINE v3.1 (FINAL)")
+    print("⚠️  NOTE: If DB schema errors occur, delete 'fresq.db' to reset.")
+    print("="*50 + "\n")
+    init_db()
+    global SESSION_SECRET
+    if not SESSION_SECRET:
+        print("⚠️  WARNING: FRESQ_SECRET_KEY not set. Sessions won't survive a restart.")
+        SESSION_SECRET = os.urandom(32)
+    render_pages()
+    conns = []
+    for _ in range(DB_POOL_SIZE):
+        conn = await aiosqlite.connect(DB_NAME)
+        await conn.executescript(SQLITE_PRAGMAS)
+        conns.append(conn)
+        DB_POOL.put_nowait(conn)
+    global SOLVER_POOL
+    SOLVER_POOL = new_solver_pool()
+    flusher = asyncio.create_task(position_flusher())
+    yield
+    flusher.cancel()
+    await flush_positions()
+    SOLVER_POOL.shutdown(cancel_futures=True)
+    # The queue outlives the app; empty it so a later startup in the same
+    # process does not hand out these closed connections
+    while not DB_POOL.empty():
+        DB_POOL.get_nowait()
+    for conn in conns:
+        await conn.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
 )
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 solver = VRPSolver()
-DB_NAME = "fresq.db"
+
+# OR-Tools runs in a separate process so a multi-second solve holds neither the
+# event loop nor the GIL. One worker is enough: solves are serialized by
+# FLEET_CACHE_LOCK, and concurrent callers share the result. The worker is
+# spawned, not forked, so it inherits neither the listening socket nor the
+# aiosqlite threads. Spawning re-imports this file (as __mp_main__ under
+# `python main.py`), which is why startup work such as init_db, the banner,
+# the session secret and page rendering lives in lifespan, not at module level.
+SOLVER_POOL: Optional[ProcessPoolExecutor] = None
+
+def new_solver_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+# --- FLEET CHANGE TRACKING ---
+# Set (and replaced by a fresh event) whenever the dispatch inputs change
+# (orders created/updated, drivers going on/off duty). Every driver stream
+# waits on it, so one change wakes them all at once and idle streams cost
+# nothing.
+FLEET_CHANGED = asyncio.Event()
+
+# Last solver result, keyed by fleet_key() of its inputs. Entries also expire
+# after FLEET_CACHE_TTL seconds so routes catch up with drift below the grid.
+FLEET_CACHE_TTL = 30
+FLEET_CACHE: Dict[str, Any] = {"key": None, "result": None, "expires": 0.0}
+FLEET_CACHE_LOCK = asyncio.Lock()
+
+# Encoded /api/orders bodies per user: (minute, encode_body result). An entry
+# is reused until the clock minute rolls over or an order/assignment changes.
+# Each order's minutes left ticks at its own created_at second, not on the
+# clock minute, so a cached body can show a countdown up to one minute stale;
+# pollers accept that in exchange for one query per user per minute.
+ORDERS_CACHE: Dict[Optional[str], Tuple[int, Dict[str, Any]]] = {}
+
+def notify_fleet_change():
+    global FLEET_CHANGED
+    changed, FLEET_CHANGED = FLEET_CHANGED, asyncio.Event()
+    changed.set()
+    FLEET_CACHE["key"] = None
+    ORDERS_CACHE.clear()
 
 # --- SECURITY UTILS ---
+# New hashes are "scrypt$<hex salt+hash>"; unprefixed hex is the legacy PBKDF2 format
+SCRYPT_PREFIX = "scrypt$"
+SCRYPT_PARAMS = {"n": 2**14, "r": 8, "p": 1, "dklen": 32}
+
 def hash_password(password: str) -> str:
     salt = os.urandom(16)
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-    return binascii.hexlify(salt + pwd_hash).decode()
+    pwd_hash = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return SCRYPT_PREFIX + binascii.hexlify(salt + pwd_hash).decode()
 
 def verify_password(stored_password: str, provided_password: str) -> bool:
     try:
-        stored_data = binascii.unhexlify(stored_password)
-        salt, stored_hash = stored_data[:16], stored_data[16:]
-        pwd_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode(), salt, 100000)
-        return pwd_hash == stored_hash
+        if stored_password.startswith(SCRYPT_PREFIX):
+            stored_data = binascii.unhexlify(stored_password[len(SCRYPT_PREFIX):])
+            salt, stored_hash = stored_data[:16], stored_data[16:]
+            pwd_hash = hashlib.scrypt(provided_password.encode(), salt=salt, **SCRYPT_PARAMS)
+        else:
+            stored_data = binascii.unhexlify(stored_password)
+            salt, stored_hash = stored_data[:16], stored_data[16:]
+            pwd_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode(), salt, 100000)
+        return hmac.compare_digest(pwd_hash, stored_hash)
     except: return False
 
+# Session cookie is "<phone>.<issued epoch>.<hmac>": verifying it needs only the
+# secret, so identifying the caller costs no DB lookup.
+SESSION_MAX_AGE = 86400
+# Without FRESQ_SECRET_KEY a random secret is generated at startup (lifespan)
+SESSION_SECRET = os.environ.get("FRESQ_SECRET_KEY", "").encode()
+
+def _session_sig(payload: str) -> str:
+    return hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).hexdigest()[:32]
+
+def sign_session(phone: str) -> str:
+    payload = f"{phone}.{int(time.time())}"
+    return f"{payload}.{_session_sig(payload)}"
+
+def session_user(request: Request) -> Optional[str]:
+    """Phone number from a valid, unexpired session cookie, else None."""
+    token = request.cookies.get("fresq_user")
+    if not token: return None
+    try:
+        payload, sig = token.rsplit(".", 1)
+        phone, issued = payload.rsplit(".", 1)
+        if not hmac.compare_digest(sig, _session_sig(payload)): return None
+        if time.time() - int(issued) > SESSION_MAX_AGE: return None
+        return phone
+    except ValueError: return None
+
 # --- DATABASE SETUP ---
+# Bump SCHEMA_VERSION whenever SCHEMA_SQL changes; files already at this version
+# skip the schema pass on startup entirely.
+SCHEMA_VERSION = 1
+SCHEMA_SQL = """
+    -- 1. Create Orders Table
+    CREATE TABLE IF NOT EXISTS orders (
+        id TEXT PRIMARY KEY, quantity INTEGER, details TEXT,
+        pickup_lat REAL, pickup_lon REAL,
+        delivery_lat REAL, delivery_lon REAL,
+        ngo_name TEXT, status TEXT,
+        created_at TIMESTAMP, expiry_hours INTEGER,
+        assigned_driver TEXT
+    );
+    
+    -- 2. Create Users Table
+    CREATE TABLE IF NOT EXISTS users (
+        phone TEXT PRIMARY KEY,
+        username TEXT,
+        password TEXT,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 0,
+        last_lat REAL DEFAULT 0.0,
+        last_lon REAL DEFAULT 0.0
+    );
+    
+    -- 3. Create Driver Trace Table (batched GPS samples from /api/driver/heartbeat)
+    CREATE TABLE IF NOT EXISTS driver_trace (
+        driver_phone TEXT,
+        lat REAL, lon REAL,
+        recorded_at TIMESTAMP
+    );
+"""
+INDEX_SQL = """
+    -- 5. Indexes for the hot predicates (partial: only pending orders / on-duty drivers are indexed)
+    -- The solver query is answered from the index alone (covering), without touching table pages
+    CREATE INDEX IF NOT EXISTS idx_orders_pending_solver ON orders(
+        status, id, quantity, pickup_lat, pickup_lon, delivery_lat, delivery_lon, created_at, expiry_hours
+    ) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active) WHERE is_active = 1;
+"""
+# 4. Columns added after the first release; older files get them on upgrade
+LEGACY_COLUMNS = [
+    ("users", "is_active", "BOOLEAN DEFAULT 0"),
+    ("users", "last_lat", "REAL DEFAULT 0.0"),
+    ("users", "last_lon", "REAL DEFAULT 0.0"),
+    ("orders", "assigned_driver", "TEXT"),
+]
+
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        
-        # 1. Create Orders Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id TEXT PRIMARY KEY, quantity INTEGER, details TEXT,
-                pickup_lat REAL, pickup_lon REAL,
-                delivery_lat REAL, delivery_lon REAL,
-                ngo_name TEXT, status TEXT,
-                created_at TIMESTAMP, expiry_hours INTEGER,
-                assigned_driver TEXT
-            )
-        ''')
-        
-        # 2. Create Users Table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                phone TEXT PRIMARY KEY,
-                username TEXT,
-                password TEXT,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 0,
-                last_lat REAL DEFAULT 0.0,
-                last_lon REAL DEFAULT 0.0
-            )
-        ''')
+    # Autocommit mode: the upgrade transaction below is opened and closed explicitly
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        conn.executescript(SQLITE_PRAGMAS)
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
         
-        # 3. Migration Check (Safe to keep)
+        # One transaction: either the whole upgrade lands (with the new user_version) or
+        # none of it. The write lock comes first, so workers starting together upgrade
+        # one at a time and each re-reads the schema the previous one left behind.
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            cursor.execute("ALTER TABLE users ADD COLUMN is_active BOOLEAN DEFAULT 0")
-            cursor.execute("ALTER TABLE users ADD COLUMN last_lat REAL DEFAULT 0.0")
-            cursor.execute("ALTER TABLE users ADD COLUMN last_lon REAL DEFAULT 0.0")
-        except: pass 
-        try:
-            cursor.execute("ALTER TABLE orders ADD COLUMN assigned_driver TEXT")
-        except: pass
-        
-        conn.commit()
-init_db()
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                conn.rollback()
+                return
+            
+            # Only tables that already exist can be missing columns; new ones are created complete
+            alters = []
+            for table, column, decl in LEGACY_COLUMNS:
+                cols = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if cols and column not in cols:
+                    alters.append(f"ALTER TABLE {table} ADD COLUMN {column} {decl};")
+            
+            # executescript would commit the open transaction first, so statements run one by one
+            statement = ""
+            for line in (SCHEMA_SQL + "\n".join(alters) + INDEX_SQL).splitlines(True):
+                statement += line
+                if sqlite3.complete_statement(statement):
+                    conn.execute(statement)
+                    statement = ""
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
 
 # --- NGO DATA ---
 NGO_DATABASE = [
@@ -101,6 +324,19 @@ NGO_DATABASE = [
     {"name": "Kota Station Aid", "city": "Kota", "lat": 25.2215, "lon": 75.8810},
 ]
 
+NGO_JSON = dump_json(NGO_DATABASE).decode()
+
+# Equirectangular projection of the catalog, done once: longitude is scaled by
+# cos(latitude) so degrees east and north count the same, and a lookup is one
+# multiply-add pass with no per-NGO trig.
+NGO_COS_REF = math.cos(math.radians(sum(n["lat"] for n in NGO_DATABASE) / len(NGO_DATABASE)))
+NGO_XY = [(n["lon"] * NGO_COS_REF, n["lat"]) for n in NGO_DATABASE]
+
+def nearest_ngo(lat: float, lon: float) -> Dict[str, Any]:
+    x, y = lon * NGO_COS_REF, lat
+    best = min(range(len(NGO_XY)), key=lambda i: (NGO_XY[i][0] - x) ** 2 + (NGO_XY[i][1] - y) ** 2)
+    return NGO_DATABASE[best]
+
 # --- Pydantic MODELS ---
 class SignupRequest(BaseModel):
     phone: str; username: str; password: str
@@ -108,19 +344,19 @@ class LoginRequest(BaseModel):
     phone: str; password: str
 class StatusToggle(BaseModel):
     is_active: bool; lat: float; lon: float
-class Heartbeat(BaseModel):
+class LocationSample(BaseModel):
     lat: float; lon: float
+    # Client epoch millis, bounded to what datetime.fromtimestamp can convert
+    # (up to the year 9999) so a bad clock is a 422 rather than a 500
+    ts: Optional[float] = Field(None, ge=0, le=253402214400000)
+class Heartbeat(BaseModel):
+    # Either a single point (legacy) or a batch of samples, oldest first
+    lat: Optional[float] = None; lon: Optional[float] = None
+    samples: List[LocationSample] = []
 
-# Internal Logic Models
-class Location(BaseModel):
-    lat: float; lon: float
-class TimeWindow(BaseModel):
-    start: int; end: int
-class Vehicle(BaseModel):
-    id: str; capacity: int; start_location: Location
-class Order(BaseModel):
-    id: str; quantity: int; pickup_location: Location; pickup_window: TimeWindow
-    delivery_location: Location; delivery_window: TimeWindow; service_time: int
+# Solver inputs live in models.py so the solver process can unpickle them
+# without importing this module
+from models import SolverVehicle, SolverOrder
 class CustomerOrderRequest(BaseModel):
     pickup_lat: float; pickup_lon: float; quantity: int; details: str; expiry_hours: float
 class StatusUpdate(BaseModel):
@@ -128,24 +364,33 @@ class StatusUpdate(BaseModel):
 
 # --- AUTH ENDPOINTS ---
 @app.post("/api/auth/signup")
-def signup(req: SignupRequest):
-    hashed_pwd = hash_password(req.password)
+async def signup(req: SignupRequest):
+    # scrypt is deliberately slow; keep it off the event loop
+    hashed_pwd = await run_in_threadpool(hash_password, req.password)
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            conn.cursor().execute("INSERT INTO users (phone, username, password) VALUES (?, ?, ?)", (req.phone, req.username, hashed_pwd))
-            conn.commit()
+        async with get_conn() as conn:
+            await conn.execute("INSERT INTO users (phone, username, password) VALUES (?, ?, ?)", (req.phone, req.username, hashed_pwd))
+            await conn.commit()
         return {"status": "success"}
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Phone number already registered")
 
 @app.post("/api/auth/login")
-def login(req: LoginRequest, response: Response):
-    with sqlite3.connect(DB_NAME) as conn:
-        user = conn.cursor().execute("SELECT password, username FROM users WHERE phone = ?", (req.phone,)).fetchone()
-    if not user or not verify_password(user[0], req.password):
+async def login(req: LoginRequest, response: Response):
+    async with get_conn() as conn:
+        async with conn.execute("SELECT password, username FROM users WHERE phone = ?", (req.phone,)) as cur:
+            user = await cur.fetchone()
+    if not user or not await run_in_threadpool(verify_password, user[0], req.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Upgrade legacy PBKDF2 hashes now that we have the plaintext
+    if not user[0].startswith(SCRYPT_PREFIX):
+        new_hash = await run_in_threadpool(hash_password, req.password)
+        async with get_conn() as conn:
+            await conn.execute("UPDATE users SET password = ? WHERE phone = ?", (new_hash, req.phone))
+            await conn.commit()
     res = JSONResponse(content={"status": "success"})
-    res.set_cookie(key="fresq_user", value=req.phone, max_age=86400)
+    res.set_cookie(key="fresq_user", value=sign_session(req.phone), max_age=SESSION_MAX_AGE, httponly=True, samesite="lax")
     return res
 
 @app.post("/api/auth/logout")
@@ -156,176 +401,345 @@ def logout(response: Response):
 
 # --- DRIVER STATUS API ---
 @app.post("/api/driver/toggle")
-def toggle_status(req: StatusToggle, request: Request):
-    user_phone = request.cookies.get("fresq_user")
+async def toggle_status(req: StatusToggle, request: Request):
+    user_phone = session_user(request)
     if not user_phone: raise HTTPException(401, "Not logged in")
     
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.cursor().execute(
+    async with get_conn() as conn:
+        await conn.execute(
             "UPDATE users SET is_active = ?, last_lat = ?, last_lon = ? WHERE phone = ?", 
             (req.is_active, req.lat, req.lon, user_phone)
         )
-        conn.commit()
+        await conn.commit()
+    # Written through just now; keep the in-memory copy from overriding it with an older fix
+    DRIVER_POS[user_phone] = (req.lat, req.lon)
+    DIRTY_POS.discard(user_phone)
+    USER_CACHE[user_phone] = (time.monotonic() + USER_CACHE_TTL, req.is_active)
+    notify_fleet_change()
     return {"status": "updated", "mode": "ON DUTY" if req.is_active else "OFF DUTY"}
 
+# --- USER CACHE ---
+# users.is_active per phone for page loads, so a reload does not hit SQLite.
+# The toggle endpoint refreshes entries; anything else expires after the TTL.
+USER_CACHE_TTL = 30
+USER_CACHE: Dict[str, Tuple[float, bool]] = {}
+
+async def cached_is_active(phone: str) -> Optional[bool]:
+    """is_active for `phone`, or None if there is no such user."""
+    hit = USER_CACHE.get(phone)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    async with get_conn() as conn:
+        async with conn.execute("SELECT is_active FROM users WHERE phone = ?", (phone,)) as cur:
+            row = await cur.fetchone()
+    if not row:
+        USER_CACHE.pop(phone, None)
+        return None
+    USER_CACHE[phone] = (time.monotonic() + USER_CACHE_TTL, bool(row[0]))
+    return bool(row[0])
+
+# --- DRIVER POSITIONS ---
+# Heartbeats only update memory; position_flusher() persists the latest fix per
+# driver and the buffered GPS trace in one batch every POSITION_FLUSH_SECONDS.
+POSITION_FLUSH_SECONDS = 10
+DRIVER_POS: Dict[str, Tuple[float, float]] = {}
+DIRTY_POS: set = set()
+TRACE_BUFFER: List[Tuple[str, float, float, str]] = []
+
+async def flush_positions():
+    global TRACE_BUFFER
+    if not DIRTY_POS and not TRACE_BUFFER: return
+    async with get_conn() as conn:
+        # Snapshot only once the connection is ours: a toggle_status that ran
+        # while we waited has already written its phone and left DIRTY_POS
+        phones = set(DIRTY_POS)
+        positions = [(DRIVER_POS[phone][0], DRIVER_POS[phone][1], phone) for phone in phones]
+        trace, TRACE_BUFFER = TRACE_BUFFER, []
+        DIRTY_POS.difference_update(phones)
+        try:
+            await conn.executemany("UPDATE users SET last_lat = ?, last_lon = ? WHERE phone = ?", positions)
+            await conn.executemany("INSERT INTO driver_trace (driver_phone, lat, lon, recorded_at) VALUES (?, ?, ?, ?)", trace)
+            await conn.commit()
+        except BaseException:
+            # Put the batch back so the next flush retries it
+            DIRTY_POS.update(phones)
+            TRACE_BUFFER = trace + TRACE_BUFFER
+            raise
+
+async def position_flusher():
+    while True:
+        await asyncio.sleep(POSITION_FLUSH_SECONDS)
+        try: await flush_positions()
+        except Exception as e: print(f"⚠️  WARNING: position flush failed: {e}")
+
 @app.post("/api/driver/heartbeat")
-def heartbeat(req: Heartbeat, request: Request):
-    user_phone = request.cookies.get("fresq_user")
+async def heartbeat(req: Heartbeat, request: Request):
+    user_phone = session_user(request)
     if not user_phone: return {"status": "ignored"}
     
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.cursor().execute(
-            "UPDATE users SET last_lat = ?, last_lon = ? WHERE phone = ?", 
-            (req.lat, req.lon, user_phone)
-        )
-        conn.commit()
-    return {"status": "ok"}
+    samples = req.samples or ([LocationSample(lat=req.lat, lon=req.lon)] if req.lat is not None and req.lon is not None else [])
+    if not samples: return {"status": "ignored"}
+    
+    now = datetime.now()
+    trace = [
+        (user_phone, s.lat, s.lon, (datetime.fromtimestamp(s.ts / 1000) if s.ts else now).isoformat())
+        for s in samples
+    ]
+    latest = samples[-1]
+    TRACE_BUFFER.extend(trace)
+    DRIVER_POS[user_phone] = (latest.lat, latest.lon)
+    DIRTY_POS.add(user_phone)
+    return {"status": "ok", "stored": len(trace)}
 
 # --- ORDER API ---
 @app.get("/api/orders")
-def get_orders(request: Request):
+async def get_orders(request: Request):
     """
     Returns ALL pending orders so drivers can see demand heatmaps.
     The frontend distinguishes between 'assigned to me' vs 'others'.
     """
+    user_phone = session_user(request)
+    minute = int(time.time() // 60)
+    cached = ORDERS_CACHE.get(user_phone)
+    if cached and cached[0] == minute:
+        encoded = cached[1]
+    else:
+        # Rebuilt at most once a minute per user, so a cheaper gzip level pays off
+        encoded = encode_body(dump_json(await pending_orders(user_phone)), compresslevel=6)
+        ORDERS_CACHE[user_phone] = (minute, encoded)
+    # Unchanged since the client's last poll: a 304 skips sending (and re-parsing) the list
+    return encoded_response(request, encoded, "application/json", "private, no-cache")
+
+# Minutes left before an order expires, computed by SQLite in the same pass as
+# the scan instead of parsing timestamps row by row in Python. A missing or
+# unparseable created_at counts as "now"; expiry 0/NULL means 24 h. Binds :now.
+MINS_LEFT_SQL = """MAX(0, CAST((
+    ROUND((COALESCE(julianday(created_at), julianday(:now)) - julianday(:now)) * 86400, 3)
+    + COALESCE(NULLIF(expiry_hours, 0), 24) * 3600) / 60 AS INTEGER))"""
+
+async def pending_orders(user_phone: Optional[str], order_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Pending orders in the /api/orders shape, optionally limited to `order_ids`."""
     orders = []
-    now = datetime.now()
-    user_phone = request.cookies.get("fresq_user")
     
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM orders WHERE status = 'pending'")
-        rows = cursor.fetchall()
+    # Priority is derived from the minutes left in the same query
+    sql = f"""
+        SELECT id, quantity, details, pickup_lat, pickup_lon, delivery_lat, delivery_lon,
+               ngo_name, status, assigned_driver, mins,
+               CASE WHEN mins <= 120 THEN 'CRITICAL' WHEN mins <= 300 THEN 'HIGH' ELSE 'NORMAL' END
+        FROM (
+            SELECT *, {MINS_LEFT_SQL} AS mins
+            FROM orders WHERE status = 'pending'
+    """
+    params: Dict[str, Any] = {"now": datetime.now().isoformat()}
+    if order_ids is not None:
+        if not order_ids: return orders
+        sql += f" AND id IN ({','.join(f':id{i}' for i in range(len(order_ids)))})"
+        params.update({f"id{i}": oid for i, oid in enumerate(order_ids)})
+    sql += ")"
+    
+    async with get_conn() as conn:
+        async with conn.execute(sql, params) as cur:
+            rows = await cur.fetchall()
         
-        for row in rows:
-            # Schema: 0:id, 1:qty, 2:details, 3:p_lat, 4:p_lon, 5:d_lat, 6:d_lon, 
-            # 7:ngo, 8:status, 9:created, 10:expiry, 11:assigned_driver
-            
-            try: created_at = datetime.fromisoformat(row[9])
-            except: created_at = now
-            
-            expiry_hours = row[10] if row[10] else 24
-            
-            expiry_time = created_at + timedelta(hours=expiry_hours)
-            minutes_remaining = int((expiry_time - now).total_seconds() / 60)
-            
-            if minutes_remaining < 0: minutes_remaining = 0 
-
-            priority_level = "NORMAL"
-            if minutes_remaining <= 120: priority_level = "CRITICAL"
-            elif minutes_remaining <= 300: priority_level = "HIGH"
-
-            assigned_to = row[11]
-            is_mine = (assigned_to == user_phone) if user_phone else False
-
-            orders.append({
-                "id": row[0], 
-                "quantity": row[1], 
-                "details": row[2],
-                "pickup_location": {"lat": row[3], "lon": row[4]},
-                "pickup_window": {"start": 0, "end": minutes_remaining},
-                "delivery_location": {"lat": row[5], "lon": row[6]},
-                "ngo_name": row[7], 
-                "status": row[8],
-                "priority_level": priority_level,
-                "assigned_driver": assigned_to,
-                "is_mine": is_mine
-            })
-            
-    return orders
+    # Columns: 0:id, 1:qty, 2:details, 3:p_lat, 4:p_lon, 5:d_lat, 6:d_lon, 
+    # 7:ngo, 8:status, 9:assigned_driver, 10:minutes_remaining, 11:priority_level
+    return [{
+        "id": row[0], 
+        "quantity": row[1], 
+        "details": row[2],
+        "pickup_location": {"lat": row[3], "lon": row[4]},
+        "pickup_window": {"start": 0, "end": row[10]},
+        "delivery_location": {"lat": row[5], "lon": row[6]},
+        "ngo_name": row[7], 
+        "status": row[8],
+        "priority_level": row[11],
+        "assigned_driver": row[9],
+        "is_mine": (row[9] == user_phone) if user_phone else False
+    } for row in rows]
 
 @app.post("/api/create_order")
-def create_order(req: CustomerOrderRequest):
+async def create_order(req: CustomerOrderRequest):
     new_id = str(uuid.uuid4())[:8]
-    ngo = min(NGO_DATABASE, key=lambda n: abs(n['lat'] - req.pickup_lat) + abs(n['lon'] - req.pickup_lon))
+    ngo = nearest_ngo(req.pickup_lat, req.pickup_lon)
     
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.cursor().execute('''
+    async with get_conn() as conn:
+        await conn.execute('''
             INSERT INTO orders (id, quantity, details, pickup_lat, pickup_lon, delivery_lat, delivery_lon, ngo_name, status, created_at, expiry_hours)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (new_id, req.quantity, req.details, req.pickup_lat, req.pickup_lon, ngo['lat'], ngo['lon'], ngo['name'], 'pending', datetime.now().isoformat(), req.expiry_hours))
-        conn.commit()
+        await conn.commit()
+    notify_fleet_change()
     return {"status": "success", "order_id": new_id, "assigned_ngo": ngo['name']}
 
 @app.post("/api/update_status")
-def update_status(upd: StatusUpdate):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.cursor().execute("UPDATE orders SET status = ? WHERE id = ?", (upd.status, upd.order_id))
-        conn.commit()
+async def update_status(upd: StatusUpdate):
+    async with get_conn() as conn:
+        await conn.execute("UPDATE orders SET status = ? WHERE id = ?", (upd.status, upd.order_id))
+        await conn.commit()
+    notify_fleet_change()
     return {"status": "success"}
 
 # --- FLEET DISPATCH LOGIC ---
 @app.post("/api/dispatch")
-def dispatch_orders(request: Request):
-    user_phone = request.cookies.get("fresq_user")
+async def dispatch_orders(request: Request):
+    """
+    Re-solves the fleet and returns the caller's route together with the
+    orders it visits, so the driver UI needs no follow-up /api/orders call.
+    """
+    return await driver_dispatch(session_user(request))
+
+async def driver_dispatch(user_phone: Optional[str]) -> Dict[str, Any]:
+    fleet = await solve_fleet()
+    if fleet is None:
+        return {"error": "No drivers are currently On Duty."}
+    routes_map, total_dist = fleet
+
+    # The solver optimized for everyone, but I only need to see MY steps.
+    my_route = routes_map.get(user_phone, [])
+    order_ids = list({step["order_id"] for step in my_route if step["type"] != "start"})
     
-    with sqlite3.connect(DB_NAME) as conn:
+    return {
+        "route": my_route,
+        "total_fleet_distance": total_dist,
+        "orders": await pending_orders(user_phone, order_ids)
+    }
+
+@app.get("/api/driver/stream")
+async def driver_stream(request: Request):
+    """
+    Server-Sent Events channel for on-duty drivers. Pushes the same payload as
+    /api/dispatch on connect and again only when FLEET_CHANGED fires,
+    replacing the client's fixed-interval polling.
+    """
+    user_phone = session_user(request)
+    if not user_phone: raise HTTPException(401, "Not logged in")
+
+    async def events():
+        while not await request.is_disconnected():
+            # Taken before solving, so a change that lands mid-solve is not missed
+            changed = FLEET_CHANGED
+            payload = await driver_dispatch(user_phone)
+            yield b"data: " + dump_json(payload) + b"\n\n"
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    if await request.is_disconnected(): return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def solve_fleet():
+    """
+    Runs the global optimization over every on-duty driver and pending order
+    and saves the resulting assignments. Returns (routes_map, total_dist), or
+    None when nobody is on duty.
+    """
+    async with get_conn() as conn:
         # 1. GET ALL ACTIVE DRIVERS (The Fleet)
-        drivers_db = conn.cursor().execute("SELECT phone, last_lat, last_lon FROM users WHERE is_active = 1").fetchall()
-        
+        async with conn.execute("SELECT phone, last_lat, last_lon FROM users WHERE is_active = 1") as cur:
+            drivers_db = await cur.fetchall()
+    
         # 2. GET ALL PENDING ORDERS (The Demand)
-        orders_db = conn.cursor().execute("SELECT * FROM orders WHERE status = 'pending'").fetchall()
+        # Only what the solver needs, all served from idx_orders_pending_solver
+        async with conn.execute(f"""
+            SELECT id, quantity, pickup_lat, pickup_lon, delivery_lat, delivery_lon, {MINS_LEFT_SQL}
+            FROM orders WHERE status = 'pending'
+        """, {"now": datetime.now().isoformat()}) as cur:
+            orders_db = await cur.fetchall()
+
+    # Heartbeat positions not yet flushed to the DB are fresher than last_lat/last_lon
+    drivers_db = [(phone, *DRIVER_POS.get(phone, (lat, lon))) for phone, lat, lon in drivers_db]
 
     if not drivers_db:
-        return {"error": "No drivers are currently On Duty."}
+        return None
     
     # If no orders, return empty route
     if not orders_db:
-        return {"route": []}
-
-    # Convert DB Drivers to Vehicle Objects
-    vehicles = []
-    for d in drivers_db:
-        # Skip if GPS is 0,0 (invalid)
-        if d[1] == 0.0 and d[2] == 0.0: continue
-        vehicles.append(Vehicle(
-            id=d[0], capacity=100, start_location=Location(lat=d[1], lon=d[2])
-        ))
-
-    # Convert DB Orders to Order Objects
-    orders = []
-    now = datetime.now()
-    for row in orders_db:
-        # row: 0:id, ..., 9:created_at, 10:expiry
-        try: created = datetime.fromisoformat(row[9])
-        except: created = now
-        expiry = row[10] or 24
-        
-        mins_left = int((created + timedelta(hours=expiry) - now).total_seconds()/60)
-        
-        orders.append(Order(
-            id=row[0], quantity=row[1],
-            pickup_location=Location(lat=row[3], lon=row[4]),
-            pickup_window=TimeWindow(start=0, end=mins_left),
-            delivery_location=Location(lat=row[5], lon=row[6]),
-            delivery_window=TimeWindow(start=0, end=mins_left),
-            service_time=10
-        ))
+        return {}, 0
+
+    # Every driver's stream re-solves on the same fleet change, and manual syncs
+    # repeat it; only the first caller for a given driver/order set runs OR-Tools.
+    key = fleet_key(drivers_db, orders_db)
+    async with FLEET_CACHE_LOCK:
+        if FLEET_CACHE["key"] == key and time.monotonic() < FLEET_CACHE["expires"]:
+            return FLEET_CACHE["result"]
+        result = await assign_fleet(drivers_db, orders_db)
+        FLEET_CACHE.update(key=key, result=result, expires=time.monotonic() + FLEET_CACHE_TTL)
+        return result
+
+def fleet_key(drivers_db, orders_db) -> bytes:
+    """
+    Identity of a solver input: pending order ids plus on-duty drivers and
+    their positions snapped to a ~50 m grid (0.0005 degrees), so GPS jitter
+    does not force a re-solve but real movement does.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for oid in sorted(row[0] for row in orders_db):
+        h.update(oid.encode() + b"\0")
+    h.update(b"|")
+    for phone, lat, lon in sorted(drivers_db):
+        h.update(f"{phone}:{round(lat * 2000)}:{round(lon * 2000)}".encode() + b"\0")
+    return h.digest()
+
+async def assign_fleet(drivers_db, orders_db):
+    """Solves the VRP for the given rows (in the solver process) and saves the assignments."""
+    # Skip drivers whose GPS is 0,0 (invalid)
+    vehicles = [SolverVehicle(phone, 100, lat, lon) for phone, lat, lon in drivers_db
+                if not (lat == 0.0 and lon == 0.0)]
+
+    # row: id, qty, p_lat, p_lon, d_lat, d_lon, minutes left
+    orders = [SolverOrder(*row, 10) for row in orders_db]
 
     # 3. RUN GLOBAL OPTIMIZATION
     # This solves for EVERYONE at once
-    routes_map, total_dist = solver.solve_route(vehicles, orders)
-
-    # 4. SAVE ASSIGNMENTS
-    with sqlite3.connect(DB_NAME) as conn:
-        for vid, route in routes_map.items():
-            for step in route:
-                if step["type"] in ['pickup', 'delivery']:
-                    oid = step["location_id"].split("_")[0]
-                    conn.cursor().execute("UPDATE orders SET assigned_driver = ? WHERE id = ?", (vid, oid))
-        conn.commit()
-
-    # 5. RETURN ONLY MY ROUTE
-    # The solver optimized for everyone, but I only need to see MY steps.
-    my_route = routes_map.get(user_phone, [])
-    
-    return {"route": my_route, "total_fleet_distance": total_dist}
+    # OR-Tools is CPU-bound for seconds; run it in the solver process
+    global SOLVER_POOL
+    loop = asyncio.get_running_loop()
+    for _ in range(2):
+        try:
+            routes_map, total_dist = await loop.run_in_executor(SOLVER_POOL, solver.solve_route, vehicles, orders)
+            break
+        except BrokenProcessPool:
+            # The worker died (OOM, a crash inside OR-Tools) and a broken pool never
+            # recovers. Callers hold FLEET_CACHE_LOCK, so swap in a fresh one and retry.
+            SOLVER_POOL.shutdown(wait=False)
+            SOLVER_POOL = new_solver_pool()
+    else:
+        raise HTTPException(503, "Route solver unavailable, try again shortly")
+
+    # 4. SAVE ASSIGNMENTS (pickup and delivery name the same order: one row per order)
+    assignments = {
+        step["order_id"]: vid
+        for vid, route in routes_map.items()
+        for step in route if step["type"] in ['pickup', 'delivery']
+    }
+    # Take the write lock up front so the batch cannot hit SQLITE_BUSY
+    # halfway through upgrading a deferred read lock.
+    async with get_conn() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        await conn.executemany(
+            "UPDATE orders SET assigned_driver = ? WHERE id = ?",
+            [(vid, oid) for oid, vid in assignments.items()]
+        )
+        await conn.commit()
+    ORDERS_CACHE.clear()
+
+    return routes_map, total_dist
 
 # --- HTML FRONTEND ---
+# Pages are static apart from a few values known at startup, so render_pages()
+# encodes, gzips and tags each one once. Requests only pick the right bytes.
+PAGES: Dict[Any, Dict[str, Any]] = {}
 
-@app.get("/", response_class=HTMLResponse)
-def landing_page():
-    return """
+def encode_page(html: str) -> Dict[str, Any]:
+    return encode_body(html.encode("utf-8"))
+
+def page_response(request: Request, page: Dict[str, Any], cache_control: str) -> Response:
+    return encoded_response(request, page, "text/html", cache_control)
+
+LANDING_PAGE_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -464,11 +878,13 @@ def landing_page():
         </script>
     </body>
     </html>
-    """
+"""
 
-@app.get("/login", response_class=HTMLResponse)
-def login_page():
-    return """
+@app.get("/", response_class=HTMLResponse)
+def landing_page(request: Request):
+    return page_response(request, PAGES["landing"], "public, max-age=3600")
+
+LOGIN_PAGE_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -684,18 +1100,13 @@ def login_page():
         </script>
     </body>
     </html>
-    """
+"""
 
-@app.get("/customer", response_class=HTMLResponse)
-def customer_app(request: Request):
-    # Security check
-    if not request.cookies.get("fresq_user"): 
-        return RedirectResponse(url="/login?target=/customer")
-    
-    # Pass NGO data to frontend
-    ngos_json = json.dumps(NGO_DATABASE)
-    
-    return f"""
+@app.get("/login", response_class=HTMLResponse)
+def login_page(request: Request):
+    return page_response(request, PAGES["login"], "public, max-age=3600")
+
+CUSTOMER_PAGE_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -703,7 +1114,10 @@ def customer_app(request: Request):
         <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
         <script src="https://cdn.tailwindcss.com"></script>
         <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" />
+        <link rel="preload" as="script" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js" />
+        <!-- Icons are not needed for first paint: fetch without blocking render -->
+        <link rel="preload" as="style" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" onload="this.onload=null;this.rel='stylesheet'" />
+        <noscript><link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" /></noscript>
         <style>
             :root {{ 
                 --bg: #f4f4f9; 
@@ -893,7 +1307,7 @@ def customer_app(request: Request):
             </button>
         </div>
 
-        <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
+        <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js" defer></script>
         <script>
             // --- UI TOGGLES ---
             function togglePanel() {{
@@ -972,11 +1386,12 @@ def customer_app(request: Request):
                 const imageData = ctx.getImageData(0, 0, 100, 100);
                 const data = imageData.data;
                 
+                // Fractional weights are scaled by 10 so the accumulators stay small integers
                 let vibrantScore = 0;
-                let dullScore = 0;
+                let dullScoreX10 = 0;
                 let matchedTrainedBad = 0;
                 
-                let syntheticScore = 0; 
+                let syntheticScoreX10 = 0; 
                 let foodColorScore = 0;
                 let totalAnalyzed = 0;
 
@@ -990,10 +1405,10 @@ def customer_app(request: Request):
                     const sat = max === 0 ? 0 : (max - min) / max;
 
                     // Edibility Filter
-                    if (b > r + 15 && b > g + 15 && avg > 40) syntheticScore++;
-                    if (r > g + 30 && b > g + 30 && avg > 100) syntheticScore++;
-                    if (sat > 0.85 && avg > 150) syntheticScore++;
-                    if (sat < 0.1 && avg > 80 && b > r) syntheticScore += 0.5;
+                    if (b > r + 15 && b > g + 15 && avg > 40) syntheticScoreX10 += 10;
+                    if (r > g + 30 && b > g + 30 && avg > 100) syntheticScoreX10 += 10;
+                    if (sat > 0.85 && avg > 150) syntheticScoreX10 += 10;
+                    if (sat < 0.1 && avg > 80 && b > r) syntheticScoreX10 += 5;
 
                     // Food Color Detection
                     if ((r > b + 10) || (g > b + 10)) foodColorScore++;
@@ -1009,17 +1424,16 @@ def customer_app(request: Request):
                     const isDarkSpot = (avg < 40);
                     
                     if (isBrownish || isDarkSpot) {{
-                        dullScore++;
+                        dullScoreX10 += 10;
                     }} else if (sat > 0.3 && avg > 60) {{
                         vibrantScore++; 
                     }} else {{
-                        dullScore += 0.2; 
+                        dullScoreX10 += 2; 
                     }}
                 }}
 
                 // Decision Logic
-                const syntheticRatio = syntheticScore / totalAnalyzed;
-                if (syntheticRatio > 0.15) {{ 
+                if (syntheticScoreX10 > 1.5 * totalAnalyzed) {{ 
                     displayResult(0, "Rejected: Non-edible object detected (Synthetic Colors/Plastic).");
                     document.getElementById('classification-msg').innerText = "Classification: Inedible Object / Packaging";
                     return;
@@ -1038,11 +1452,12 @@ def customer_app(request: Request):
                     return;
                 }}
 
-                const totalConsidered = vibrantScore + dullScore;
-                const freshRatio = totalConsidered === 0 ? 0 : vibrantScore / totalConsidered;
+                const vibrantScoreX10 = vibrantScore * 10;
+                const totalConsideredX10 = vibrantScoreX10 + dullScoreX10;
+                const freshRatio = totalConsideredX10 === 0 ? 0 : vibrantScoreX10 / totalConsideredX10;
                 
                 let score = Math.floor(freshRatio * 130); 
-                if (dullScore > vibrantScore) score = Math.min(score, 45); 
+                if (dullScoreX10 > vibrantScoreX10) score = Math.min(score, 45); 
                 
                 const finalScore = Math.min(99, score);
                 displayResult(finalScore);
@@ -1098,20 +1513,40 @@ def customer_app(request: Request):
             }}
 
             // --- MAP & SUBMIT LOGIC ---
-            const map = L.map('map', {{zoomControl:false}}).setView([25.1825, 75.8236], 13);
             const lightTiles = 'https://{{s}}.basemaps.cartocdn.com/light_all/{{z}}/{{x}}/{{y}}{{r}}.png';
             const darkTiles = 'https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png';
-            let tileLayer = L.tileLayer(lightTiles).addTo(map);
-            
             const ngos = {ngos_json};
-            ngos.forEach(n => {{
-                L.circleMarker([n.lat, n.lon], {{
-                    color: '#555', radius: 6, fillColor: '#fff', fillOpacity: 1
-                }}).addTo(map).bindPopup("<b>NGO:</b> " + n.name);
-            }});
             
+            let map = null;
+            let tileLayer = null;
             let pickupLoc = null; 
             let marker = null;
+
+            // Leaflet, tiles and NGO markers are only set up once the map is actually visible
+            function initMap() {{
+                map = L.map('map', {{zoomControl:false}}).setView([25.1825, 75.8236], 13);
+                const isDark = document.body.classList.contains('dark-mode');
+                tileLayer = L.tileLayer(isDark ? darkTiles : lightTiles).addTo(map);
+                
+                ngos.forEach(n => {{
+                    L.circleMarker([n.lat, n.lon], {{
+                        color: '#555', radius: 6, fillColor: '#fff', fillOpacity: 1
+                    }}).addTo(map).bindPopup("<b>NGO:</b> " + n.name);
+                }});
+                
+                map.on('click', onMapClick);
+            }}
+
+            // Deferred scripts (leaflet.js) have run by the time DOMContentLoaded fires
+            document.addEventListener('DOMContentLoaded', () => {{
+                const mapEl = document.getElementById('map');
+                if (!('IntersectionObserver' in window)) return initMap();
+                
+                const obs = new IntersectionObserver(([e]) => {{
+                    if (e.isIntersecting) {{ initMap(); obs.disconnect(); }}
+                }});
+                obs.observe(mapEl);
+            }});
             
             const now = new Date();
             now.setMinutes(now.getMinutes() - now.getTimezoneOffset());
@@ -1123,7 +1558,7 @@ def customer_app(request: Request):
                 alert("Tap anywhere on the map to set the pickup pin.");
             }}
 
-            map.on('click', e => {{
+            function onMapClick(e) {{
                 pickupLoc = e.latlng;
                 if(marker) map.removeLayer(marker);
                 
@@ -1142,7 +1577,7 @@ def customer_app(request: Request):
                 
                 // Re-open panel after pin set
                 document.getElementById('mainPanel').classList.remove('minimized');
-            }});
+            }}
 
             async function submit() {{
                 // 1. Check AI Status
@@ -1161,8 +1596,9 @@ def customer_app(request: Request):
                 if(!mfgDateVal || !lifeVal) return alert("Please enter Manufacture Date and Shelf Life.");
 
                 const mfgDate = new Date(mfgDateVal);
+                // The unit <option> values are already the hour multipliers (1 / 24 / 168)
                 const unitMult = parseInt(document.getElementById('life_unit').value);
-                const totalHours = parseFloat(lifeVal) * (unitMult === 1 ? 1 : (unitMult === 24 ? 24 : 168));
+                const totalHours = parseFloat(lifeVal) * unitMult;
                 
                 const expiryDate = new Date(mfgDate.getTime() + (totalHours * 60 * 60 * 1000));
                 const now = new Date();
@@ -1211,7 +1647,7 @@ def customer_app(request: Request):
                 const isDark = document.body.classList.contains('dark-mode');
                 document.getElementById('theme-icon').className = isDark ? 'fas fa-sun' : 'fas fa-moon';
                 const url = isDark ? darkTiles : lightTiles;
-                tileLayer.setUrl(url);
+                if (tileLayer) tileLayer.setUrl(url);
             }}
 
             async function logout() {{
@@ -1221,35 +1657,27 @@ def customer_app(request: Request):
         </script>
     </body>
     </html>
-    """
+"""
 
-@app.get("/driver", response_class=HTMLResponse)
-def driver_app(request: Request):
-    user_phone = request.cookies.get("fresq_user")
-    
-    # 1. Check if cookie exists
-    if not user_phone: 
-        return RedirectResponse(url="/login?target=/driver")
-    
-    # 2. Check if User actually exists in DB
-    with sqlite3.connect(DB_NAME) as conn:
-        row = conn.cursor().execute("SELECT is_active FROM users WHERE phone = ?", (user_phone,)).fetchone()
-    
-    if not row:
-        response = RedirectResponse(url="/login?target=/driver")
-        response.delete_cookie("fresq_user")
-        return response
-    
-    db_is_active = "true" if row[0] else "false"
+@app.get("/customer", response_class=HTMLResponse)
+def customer_app(request: Request):
+    # Security check
+    if not session_user(request): 
+        return RedirectResponse(url="/login?target=/customer")
     
-    return f"""
+    return page_response(request, PAGES["customer"], "private, no-cache")
+
+DRIVER_PAGE_TEMPLATE = """
     <!DOCTYPE html>
     <html>
     <head>
         <title>FresQ Driver</title>
         <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />
         <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" />
+        <link rel="preload" as="script" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js" />
+        <!-- Icon font is not needed for first paint; swap it in once loaded -->
+        <link rel="preload" as="style" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" onload="this.onload=null;this.rel='stylesheet'" />
+        <noscript><link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" /></noscript>
         <style>
             :root {{ 
                 --bg: #f4f4f9; 
@@ -1340,6 +1768,9 @@ def driver_app(request: Request):
                 margin-bottom: 15px; 
                 border-left: 6px solid #555; 
                 box-shadow: 0 4px 15px rgba(0,0,0,0.03);
+                /* Off-screen cards skip layout and paint until scrolled into view */
+                content-visibility: auto; 
+                contain-intrinsic-size: 160px;
             }}
 
             .info-row {{ display:flex; align-items:flex-start; margin-bottom:8px; gap:10px; font-size:0.95rem; line-height:1.4; }}
@@ -1423,14 +1854,47 @@ def driver_app(request: Request):
                 </div>
             </div>
             
-            <button class="btn-opt" onclick="dispatch(true)" id="optBtn" disabled style="opacity:0.5">SYNC FLEET</button>
+            <button class="btn-opt" onclick="dispatch()" id="optBtn" disabled style="opacity:0.5">SYNC FLEET</button>
+            
+            <template id="task-card-tmpl">
+                <div class="task-card">
+                    <div style="display:flex;justify-content:space-between;font-size:0.8rem;font-weight:bold;margin-bottom:10px;">
+                        <span class="step-label"></span>
+                        <span class="card-id" style="opacity:0.5"></span>
+                    </div>
+                    
+                    <div class="info-row">
+                        <i class="fas fa-map-marker-alt card-pin"></i>
+                        <span class="card-address" style="font-weight:700; font-size:1rem;"></span>
+                    </div>
+                    
+                    <div class="info-row">
+                        <i class="fas fa-box"></i>
+                        <span class="card-desc"></span>
+                    </div>
+                    
+                    <div class="info-row card-priority">
+                        <i class="fas fa-clock"></i>
+                        <span style="font-weight:bold;"></span>
+                    </div>
+                    
+                    <div class="card-actions">
+                        <button class="action-btn btn-nav" data-action="nav">
+                            <i class="fas fa-location-arrow"></i> Navigate
+                        </button>
+                        <button class="action-btn btn-done" data-action="done">
+                            <i class="fas fa-check-circle"></i> Complete
+                        </button>
+                    </div>
+                </div>
+            </template>
         </div>
 
         <div id="map">
             <div class="recenter-btn" onclick="recenterMap()"><i class="fas fa-crosshairs"></i></div>
         </div>
         
-        <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
+        <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js" defer></script>
         
         <script>
             // --- STATE ---
@@ -1438,19 +1902,57 @@ def driver_app(request: Request):
             let driverLoc = null; 
             let driverMarker = null; 
             let watchId = null;
+            let fleetStream = null;
+            
+            // Position is only reported after real movement (or as a periodic keepalive)
+            const MIN_DIST_M = 25;
+            const MAX_REPORT_INTERVAL_MS = 60000;
+            let lastReportedLoc = null;
+            let lastReportedCos = 1;
+            let lastReportedTs = 0;
+            
+            // After this long without movement the watch drops to coarse (network) positioning
+            // so the GPS radio can sleep; the first real move switches it back
+            const STATIONARY_MS = 120000;
+            let lastMovedTs = 0;
+            let lowPowerGps = false;
+            
+            // Gated fixes are buffered and posted as one batch instead of one request per fix
+            const HEARTBEAT_FLUSH_MS = 30000;
+            let locBuffer = [];
+            let flushTimer = null;
             
             // --- MAP INIT ---
-            const map = L.map('map', {{zoomControl:false}}).setView([25.1825, 75.8236], 13);
+            let map, tileLayer, routeLayer;
             
             // Tile Layers
             const lightTiles = 'https://{{s}}.basemaps.cartocdn.com/light_all/{{z}}/{{x}}/{{y}}{{r}}.png';
             const darkTiles = 'https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png';
-            let tileLayer = L.tileLayer(lightTiles).addTo(map);
             
-            const routeLayer = L.layerGroup().addTo(map);
+            function initMap() {{
+                // Vector layers (the route polyline) draw into one canvas instead of per-layer SVG nodes
+                map = L.map('map', {{
+                    zoomControl: false, 
+                    preferCanvas: true, 
+                    renderer: L.canvas({{padding: 0.5}})
+                }}).setView([25.1825, 75.8236], 13);
+                
+                // Fetch tiles only once panning settles and keep a single ring of off-screen tiles
+                tileLayer = L.tileLayer(lightTiles, {{
+                    detectRetina: false, 
+                    updateWhenIdle: true, 
+                    keepBuffer: 1
+                }}).addTo(map);
+                
+                routeLayer = L.layerGroup().addTo(map);
+                map.on('moveend', clipMarkers);
+            }}
 
             // --- ON LOAD ---
-            window.onload = function() {{
+            // Deferred scripts (leaflet.js) have run by the time DOMContentLoaded fires
+            document.addEventListener('DOMContentLoaded', () => {{
+                initMap();
+                
                 const toggle = document.getElementById('dutyToggle'); 
                 toggle.checked = isOnDuty; 
                 updateUI(isOnDuty);
@@ -1458,7 +1960,7 @@ def driver_app(request: Request):
                 if (isOnDuty) {{
                     requestAndToggleDuty(true); 
                 }}
-            }};
+            }});
 
             // --- GPS & PERMISSIONS ---
             function requestAndToggleDuty(isRestoring = false) {{
@@ -1474,6 +1976,7 @@ def driver_app(request: Request):
                     navigator.geolocation.getCurrentPosition(
                         (pos) => {{ 
                             isOnDuty = true; 
+                            driverLoc = {{lat: pos.coords.latitude, lon: pos.coords.longitude}}; 
                             startTracking(); 
                             handleToggleAPI(true); 
                         }},
@@ -1494,36 +1997,86 @@ def driver_app(request: Request):
 
             function startTracking() {{
                 if (watchId) return;
+                lastMovedTs = Date.now();
+                watchGps(true);
+                flushTimer = setInterval(flushHeartbeat, HEARTBEAT_FLUSH_MS);
+                updateUI(true);
+            }}
+
+            function watchGps(highAccuracy) {{
+                if (watchId) navigator.geolocation.clearWatch(watchId);
+                lowPowerGps = !highAccuracy;
                 watchId = navigator.geolocation.watchPosition(
-                    (p) => {{ 
-                        driverLoc = {{lat: p.coords.latitude, lon: p.coords.longitude}}; 
-                        updateDriverMarker(); 
-                    }},
+                    onGpsFix, 
                     (e) => console.error(e), 
-                    {{ enableHighAccuracy: true }}
-                ); 
-                updateUI(true);
+                    highAccuracy ? {{ enableHighAccuracy: true }} : {{ enableHighAccuracy: false, maximumAge: 30000 }}
+                );
+            }}
+
+            function onGpsFix(p) {{
+                const fix = {{lat: p.coords.latitude, lon: p.coords.longitude}};
+                const now = Date.now();
+                
+                // A coarse fix only counts as movement once it leaves its own error radius
+                const gate = lowPowerGps ? Math.max(MIN_DIST_M, p.coords.accuracy || 0) : MIN_DIST_M;
+                const moved = lastReportedLoc ? distSqFromLastReport(fix) > gate * gate : true;
+                if (moved) {{
+                    lastMovedTs = now;
+                    if (lowPowerGps) watchGps(true);
+                }} else if (!lowPowerGps && now - lastMovedTs > STATIONARY_MS) {{
+                    watchGps(false);
+                }}
+                
+                // Keep the last precise position while a coarse fix is within its error
+                if (moved || !lowPowerGps) driverLoc = fix;
+                
+                if (moved || now - lastReportedTs > MAX_REPORT_INTERVAL_MS) {{
+                    lastReportedLoc = driverLoc;
+                    lastReportedCos = Math.cos(driverLoc.lat * Math.PI / 180);
+                    lastReportedTs = now;
+                    updateDriverMarker(); 
+                    locBuffer.push({{lat: driverLoc.lat, lon: driverLoc.lon, ts: lastReportedTs}}); 
+                }}
             }}
 
             function stopTracking() {{ 
                 if (watchId) navigator.geolocation.clearWatch(watchId); 
                 watchId = null; 
+                lowPowerGps = false; 
+                lastReportedLoc = null; 
+                clearInterval(flushTimer); 
+                flushTimer = null; 
+                flushHeartbeat(); 
+                closeFleetStream(); 
                 if (driverMarker) map.removeLayer(driverMarker); 
+                driverMarker = null; 
                 updateUI(false); 
             }}
 
+            // GPS fixes only record the position; the marker is moved at most once per frame
+            let markerFrameQueued = false;
+
             function updateDriverMarker() {{
-                if (!driverLoc) return; 
-                if (driverMarker) map.removeLayer(driverMarker);
+                if (!driverLoc || markerFrameQueued) return; 
+                markerFrameQueued = true;
                 
-                const icon = L.divIcon({{
-                    className: 'c', 
-                    html: '<div class="driver-pin"></div>', 
-                    iconSize: [20, 20], 
-                    iconAnchor: [10, 10]
+                requestAnimationFrame(() => {{
+                    markerFrameQueued = false;
+                    if (!watchId || !driverLoc) return;
+                    
+                    if (driverMarker) {{
+                        driverMarker.setLatLng([driverLoc.lat, driverLoc.lon]);
+                        return;
+                    }}
+                    
+                    const icon = L.divIcon({{
+                        className: 'c', 
+                        html: '<div class="driver-pin"></div>', 
+                        iconSize: [20, 20], 
+                        iconAnchor: [10, 10]
+                    }});
+                    driverMarker = L.marker([driverLoc.lat, driverLoc.lon], {{icon: icon}}).addTo(map);
                 }});
-                
-                driverMarker = L.marker([driverLoc.lat, driverLoc.lon], {{icon: icon}}).addTo(map);
             }}
             
             function recenterMap() {{ 
@@ -1531,194 +2084,339 @@ def driver_app(request: Request):
             }}
 
             // --- API INTERACTIONS ---
+            // Fire-and-forget POST: nothing waits on the response, and it survives page unload
+            function postJSON(url, body) {{
+                const blob = new Blob([JSON.stringify(body)], {{type: 'application/json'}});
+                if (navigator.sendBeacon && navigator.sendBeacon(url, blob)) return;
+                fetch(url, {{method: 'POST', headers: {{'Content-Type':'application/json'}}, body: blob, keepalive: true}});
+            }}
+            
             async function handleToggleAPI(status) {{ 
+                const body = {{
+                    is_active: status, 
+                    lat: driverLoc ? driverLoc.lat : 0, 
+                    lon: driverLoc ? driverLoc.lon : 0
+                }};
+                if (!status) return postJSON('/api/driver/toggle', body);
+                
+                // Going on duty must land before the stream connects, or the first push has no driver
                 await fetch('/api/driver/toggle', {{
                     method: 'POST', 
                     headers: {{'Content-Type':'application/json'}}, 
-                    body: JSON.stringify({{
-                        is_active: status, 
-                        lat: driverLoc ? driverLoc.lat : 0, 
-                        lon: driverLoc ? driverLoc.lon : 0
-                    }})
+                    body: JSON.stringify(body)
                 }}); 
-                if (status) dispatch(true); 
+                // The stream pushes the first route as soon as it connects
+                openFleetStream(); 
             }}
             
-            async function sendHeartbeat() {{ 
-                if(isOnDuty && driverLoc) {{
-                    await fetch('/api/driver/heartbeat', {{
-                        method: 'POST', 
-                        headers: {{'Content-Type':'application/json'}}, 
-                        body: JSON.stringify({{lat: driverLoc.lat, lon: driverLoc.lon}})
-                    }}); 
+            // `now` also reports the current fix when nothing is buffered (server needs a position right away)
+            function flushHeartbeat(now = false) {{ 
+                if (now && isOnDuty && driverLoc && locBuffer.length === 0) {{
+                    locBuffer.push({{lat: driverLoc.lat, lon: driverLoc.lon, ts: Date.now()}});
                 }}
+                if (locBuffer.length === 0) return;
+                
+                const samples = locBuffer; 
+                locBuffer = [];
+                postJSON('/api/driver/heartbeat', {{samples: samples}}); 
+            }}
+
+            // --- FLEET STREAM (server pushes routes only when they change) ---
+            function openFleetStream() {{
+                if (fleetStream || document.hidden) return;
+                fleetStream = new EventSource('/api/driver/stream');
+                fleetStream.onmessage = (e) => {{
+                    const data = JSON.parse(e.data);
+                    if (data.error) {{
+                        if (data.error.includes("No drivers")) flushHeartbeat(true);
+                        return;
+                    }}
+                    routeSeq++;
+                    const orderById = indexOrders(data.orders);
+                    drawRoute(data.route, orderById);
+                    renderList(data.route, orderById);
+                }};
+            }}
+
+            function closeFleetStream() {{
+                if (fleetStream) fleetStream.close();
+                fleetStream = null;
             }}
 
-            async function dispatch(showUI = false) {{
+            // Hidden tabs don't need live routes: drop the stream and resync on return
+            // (the stream pushes a fresh route as soon as it reconnects)
+            document.addEventListener('visibilitychange', () => {{
+                if (document.hidden) {{ 
+                    closeFleetStream(); 
+                    flushHeartbeat(); 
+                }}
+                else if (isOnDuty) openFleetStream();
+            }});
+
+            // Bumped on every route the stream renders. A SYNC response is dropped if the
+            // stream rendered after the request started: its route would be older.
+            let routeSeq = 0;
+
+            // SYNC FLEET button: the button stays disabled while a request is in flight
+            async function dispatch() {{
                 if(!isOnDuty) return;
+                const seq = routeSeq;
                 const btn = document.getElementById('optBtn'); 
-                
-                if(showUI) {{
-                    btn.innerText = "OPTIMIZING...";
-                    btn.disabled = true;
-                }}
+                btn.innerText = "OPTIMIZING...";
+                btn.disabled = true;
                 
                 try {{
-                    const res = await fetch('/api/dispatch', {{method:'POST'}}); 
-                    const data = await res.json();
+                    // The dispatch response already carries the orders on my route
+                    const res = await fetch('/api/dispatch', {{method:'POST'}});
+                    const {{route, orders, error}} = await res.json();
                     
-                    if(data.error) {{ 
-                        if(data.error.includes("No drivers")) sendHeartbeat(); 
-                        if(showUI) btn.innerText = "SYNC FLEET"; 
-                        if(showUI) btn.disabled = false;
-                        return; 
+                    if(error) {{ 
+                        if(error.includes("No drivers")) flushHeartbeat(true); 
+                    }} else if(seq === routeSeq) {{
+                        const orderById = indexOrders(orders);
+                        drawRoute(route, orderById); 
+                        renderList(route, orderById);
                     }}
-                    
-                    const ordersRes = await fetch('/api/orders'); 
-                    const allOrders = await ordersRes.json();
-                    
-                    drawRoute(data.route, allOrders); 
-                    renderList(data.route, allOrders);
-                    
-                }} catch(e) {{ console.error(e); }}
-                
-                if(showUI) {{
-                    btn.innerText = "SYNC FLEET";
-                    btn.disabled = false;
+                }} catch(e) {{ 
+                    console.error(e); 
                 }}
+                
+                btn.innerText = "SYNC FLEET";
+                btn.disabled = false;
             }}
 
             // --- RENDERERS ---
-            function renderList(route, orders) {{
+            // Task cards keyed by location_id; a card is only rebuilt when its content changes
+            const cardCache = new Map();
+
+            function renderList(route, orderById) {{
                 const list = document.getElementById('list');
                 
                 if(!route || route.length === 0) {{ 
+                    cardCache.clear(); 
                     list.innerHTML = "<div style='text-align:center; padding:30px; opacity:0.6;'>No orders assigned.<br>Wait for dispatch.</div>"; 
                     return; 
                 }}
                 
-                let html = ""; 
+                const nodes = []; 
+                const seen = new Set(); 
                 let stepNum = 1;
                 
                 route.forEach(step => {{
                     if(step.type === 'start') return;
-                    const order = orders.find(o => o.id == step.location_id.split('_')[0]); 
+                    const order = orderById.get(step.order_id); 
                     if(!order) return;
                     
                     const isPickup = step.type === 'pickup';
                     const color = isPickup ? '#2ecc71' : '#e74c3c';
                     
-                    // --- PARSING ADDRESS LOGIC ---
-                    let address = "Unknown Location";
-                    let desc = isPickup ? order.details : order.ngo_name;
-                    
-                    if(isPickup && order.details.startsWith('[')) {{
-                        const closing = order.details.indexOf(']');
-                        if(closing > -1) {{
-                            address = order.details.substring(1, closing);
-                            desc = order.details.substring(closing + 1).trim();
-                        }}
-                    }} else if (!isPickup) {{
-                        address = order.ngo_name + ", Kota"; // Fallback for NGO
-                        desc = "Drop off donation";
-                    }}
+                    // Parsed once per payload in indexOrders()
+                    const address = isPickup ? order._address : order._ngoAddress;
+                    const desc = isPickup ? order._desc : "Drop off donation";
                     
                     // Navigation Coordinates
                     const lat = isPickup ? order.pickup_location.lat : order.delivery_location.lat;
                     const lon = isPickup ? order.pickup_location.lon : order.delivery_location.lon;
                     
-                    html += `
-                    <div class="task-card" style="border-left-color:${{color}}">
-                        <div style="display:flex;justify-content:space-between;font-size:0.8rem;font-weight:bold;margin-bottom:10px;">
-                            <span>STEP ${{stepNum++}} • ${{step.type.toUpperCase()}}</span>
-                            <span style="opacity:0.5">#${{order.id.substring(0,4)}}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <i class="fas fa-map-marker-alt" style="color:${{color}}"></i>
-                            <span style="font-weight:700; font-size:1rem;">${{address}}</span>
-                        </div>
-                        
-                        <div class="info-row">
-                            <i class="fas fa-box"></i>
-                            <span>${{desc}}</span>
-                        </div>
-                        
-                        <div class="info-row" style="color:${{order.priority_level === 'CRITICAL' ? '#e74c3c' : '#2ecc71'}}">
-                            <i class="fas fa-clock"></i>
-                            <span style="font-weight:bold;">${{order.priority_level}} PRIORITY</span>
-                        </div>
-                        
-                        <div class="card-actions">
-                            <button class="action-btn btn-nav" onclick="navigate(${{lat}}, ${{lon}})">
-                                <i class="fas fa-location-arrow"></i> Navigate
-                            </button>
-                            <button class="action-btn btn-done" onclick="completeTask('${{order.id}}', '${{step.type}}')">
-                                <i class="fas fa-check-circle"></i> Complete
-                            </button>
-                        </div>
-                    </div>`;
+                    const key = step.location_id;
+                    const hash = `${{order.priority_level}}|${{address}}|${{desc}}|${{lat}}|${{lon}}`;
+                    let entry = cardCache.get(key);
+                    
+                    if (!entry || entry.hash !== hash) {{
+                        const node = buildCard(order, step.type, color, address, desc, lat, lon);
+                        entry = {{node: node, label: node.querySelector('.step-label'), hash: hash}};
+                        cardCache.set(key, entry);
+                    }}
+                    
+                    // Step numbers shift as tasks complete, so they are patched in place
+                    const label = `STEP ${{stepNum++}} • ${{step.type.toUpperCase()}}`;
+                    if (entry.label.textContent !== label) entry.label.textContent = label;
+                    
+                    seen.add(key);
+                    nodes.push(entry.node);
                 }});
                 
-                list.innerHTML = html;
+                for (const key of cardCache.keys()) {{
+                    if (!seen.has(key)) cardCache.delete(key);
+                }}
+                const frag = document.createDocumentFragment();
+                for (const node of nodes) frag.appendChild(node);
+                list.replaceChildren(frag);
+            }}
+
+            // Cards are cloned from #task-card-tmpl and filled via textContent, no HTML parsing per card
+            const cardTmpl = document.getElementById('task-card-tmpl').content.firstElementChild;
+
+            function buildCard(order, type, color, address, desc, lat, lon) {{
+                const node = cardTmpl.cloneNode(true);
+                node.style.borderLeftColor = color;
+                node.querySelector('.card-id').textContent = '#' + order._shortId;
+                node.querySelector('.card-pin').style.color = color;
+                node.querySelector('.card-address').textContent = address;
+                node.querySelector('.card-desc').textContent = desc;
+                
+                const prio = node.querySelector('.card-priority');
+                prio.style.color = order.priority_level === 'CRITICAL' ? '#e74c3c' : '#2ecc71';
+                prio.querySelector('span').textContent = order.priority_level + ' PRIORITY';
+                
+                const nav = node.querySelector('.btn-nav');
+                nav.dataset.lat = lat; 
+                nav.dataset.lon = lon;
+                const done = node.querySelector('.btn-done');
+                done.dataset.id = order.id; 
+                done.dataset.type = type;
+                return node;
             }}
             
             // --- ACTION HANDLERS ---
+            // One delegated listener for every card button; cards only carry data-* attributes
+            document.getElementById('list').addEventListener('click', (e) => {{
+                const btn = e.target.closest('button[data-action]');
+                if (!btn) return;
+                const d = btn.dataset;
+                if (d.action === 'nav') navigate(+d.lat, +d.lon);
+                else if (d.action === 'done') completeTask(d.id, d.type);
+            }});
+
             function navigate(lat, lon) {{
                 // Opens Universal Google Maps Directions
                 window.open(`https://www.google.com/maps/dir/?api=1&destination=${{lat}},${{lon}}`, '_blank');
             }}
 
-            async function completeTask(orderId, type) {{
+            function completeTask(orderId, type) {{
                 if(!confirm("Mark this task as completed?")) return;
                 
                 // Pickup -> 'in_transit', Delivery -> 'completed'
                 const status = type === 'pickup' ? 'in_transit' : 'completed';
+                postJSON('/api/update_status', {{ order_id: orderId, status: status }});
                 
-                await fetch('/api/update_status', {{
-                    method: 'POST',
-                    headers: {{'Content-Type':'application/json'}},
-                    body: JSON.stringify({{ order_id: orderId, status: status }})
+                // Drop the card right away; the fleet stream pushes the re-solved route once the update lands
+                const key = orderId + '_' + type;
+                const entry = cardCache.get(key);
+                if (entry) {{
+                    entry.node.remove();
+                    cardCache.delete(key);
+                }}
+            }}
+
+            // Step markers keyed by location_id, moved/relabelled in place between redraws
+            const markerPool = new Map();
+            let routePolyline = null;
+            let lastRouteSig = '';
+
+            function stepIcon(color, num) {{
+                return L.divIcon({{
+                    className:'p', 
+                    html:`<div class="pin-wrap" style="background:${{color}}"><span class="pin-num">${{num}}</span></div>`, 
+                    iconSize:[34,44], 
+                    iconAnchor:[17,44]
                 }});
-                
-                dispatch(true); // Force UI refresh
             }}
 
-            function drawRoute(route, orders) {{
+            function clearRoute() {{
                 routeLayer.clearLayers(); 
-                if(!route || route.length === 0) return;
+                markerPool.clear(); 
+                routePolyline = null; 
+                lastRouteSig = '';
+            }}
+
+            // Only pins inside the (padded) viewport are kept on the map; re-run on every pan/zoom
+            function clipMarkers() {{
+                const bounds = map.getBounds().pad(0.2);
+                for (const entry of markerPool.values()) {{
+                    const inView = bounds.contains(entry.marker.getLatLng());
+                    const onMap = routeLayer.hasLayer(entry.marker);
+                    if (inView && !onMap) routeLayer.addLayer(entry.marker);
+                    else if (!inView && onMap) routeLayer.removeLayer(entry.marker);
+                }}
+            }}
+
+            function drawRoute(route, orderById) {{
+                if(!route || route.length === 0) return clearRoute();
+                
+                // Stream pushes often carry the same plan; nothing to redraw then
+                const sig = (driverLoc ? driverLoc.lat + ',' + driverLoc.lon : '') + '|' + 
+                    route.map(s => s.location_id + s.type).join('|');
+                if (sig === lastRouteSig) return;
+                lastRouteSig = sig;
                 
                 const points = []; 
                 if (driverLoc) points.push(driverLoc);
+                const used = new Set();
                 let stepNum = 1;
                 
                 route.forEach(step => {{
                     if(step.type === 'start') return;
-                    const order = orders.find(o => o.id == step.location_id.split('_')[0]); 
+                    const order = orderById.get(step.order_id); 
                     if(!order) return;
                     
                     const loc = step.type === 'pickup' ? order.pickup_location : order.delivery_location; 
                     points.push(loc);
                     
                     const color = step.type === 'pickup' ? '#2ecc71' : '#e74c3c';
+                    const num = stepNum++;
+                    const key = step.location_id;
+                    let entry = markerPool.get(key);
                     
-                    const icon = L.divIcon({{
-                        className:'p', 
-                        html:`<div class="pin-wrap" style="background:${{color}}"><span class="pin-num">${{stepNum++}}</span></div>`, 
-                        iconSize:[34,44], 
-                        iconAnchor:[17,44]
-                    }});
-                    
-                    L.marker([loc.lat, loc.lon], {{icon: icon}}).addTo(routeLayer);
+                    if (!entry) {{
+                        const marker = L.marker([loc.lat, loc.lon], {{icon: stepIcon(color, num)}});
+                        entry = {{marker: marker, num: num}};
+                        markerPool.set(key, entry);
+                    }} else {{
+                        entry.marker.setLatLng([loc.lat, loc.lon]);
+                        if (entry.num !== num) {{
+                            entry.marker.setIcon(stepIcon(color, num));
+                            entry.num = num;
+                        }}
+                    }}
+                    used.add(key);
                 }});
                 
-                if(points.length > 1) {{
-                    const latlngs = points.map(p => [p.lat, p.lon]);
-                    L.polyline(latlngs, {{color:'#ff6b00', weight:6, opacity:0.8}}).addTo(routeLayer);
+                for (const [key, entry] of markerPool) {{
+                    if (!used.has(key)) {{
+                        routeLayer.removeLayer(entry.marker);
+                        markerPool.delete(key);
+                    }}
+                }}
+                
+                const latlngs = points.length > 1 ? points.map(p => [p.lat, p.lon]) : [];
+                if (!routePolyline) {{
+                    routePolyline = L.polyline([], {{color:'#ff6b00', weight:6, opacity:0.8}}).addTo(routeLayer);
                 }}
+                routePolyline.setLatLngs(latlngs);
+                clipMarkers();
             }}
 
             // --- UTILS ---
+            // Also precomputes the card text fields so renders do no string parsing
+            function indexOrders(orders) {{
+                for (const o of orders) {{
+                    o._shortId = String(o.id).slice(0, 4);
+                    o._address = "Unknown Location";
+                    o._desc = o.details;
+                    
+                    // --- PARSING ADDRESS LOGIC --- details look like "[address] description"
+                    if (o.details && o.details.startsWith('[')) {{
+                        const closing = o.details.indexOf(']');
+                        if (closing > -1) {{
+                            o._address = o.details.slice(1, closing);
+                            o._desc = o.details.slice(closing + 1).trim();
+                        }}
+                    }}
+                    o._ngoAddress = o.ngo_name + ", Kota"; // Fallback for NGO
+                }}
+                return new Map(orders.map(o => [String(o.id), o]));
+            }}
+
+            // Squared metres from the last reported fix. Equirectangular is exact enough at gate
+            // distances and, with cos(lat) cached per report, costs no trig per GPS fix.
+            function distSqFromLastReport(p) {{
+                const M_PER_DEG = 111320;
+                const dy = (p.lat - lastReportedLoc.lat) * M_PER_DEG;
+                const dx = (p.lon - lastReportedLoc.lon) * M_PER_DEG * lastReportedCos;
+                return dx * dx + dy * dy;
+            }}
+
             function updateUI(active) {{
                 const label = document.getElementById('status-label');
                 label.innerText = active ? "ON DUTY" : "OFF DUTY"; 
@@ -1727,8 +2425,9 @@ def driver_app(request: Request):
                 document.getElementById('optBtn').style.opacity = active ? "1" : "0.5";
                 
                 if(!active) {{ 
+                    cardCache.clear(); 
                     document.getElementById('list').innerHTML = "<div style='text-align:center; padding:50px 20px; opacity:0.6; font-size:1.1rem;'>Go On Duty to track location.</div>"; 
-                    routeLayer.clearLayers(); 
+                    clearRoute(); 
                 }}
             }}
             
@@ -1737,25 +2436,58 @@ def driver_app(request: Request):
                 const isDark = document.body.classList.contains('dark-mode');
                 document.getElementById('theme-icon').className = isDark ? 'fas fa-sun' : 'fas fa-moon';
                 
-                // Toggle Map Tiles
-                const url = isDark 
-                    ? 'https://{{s}}.basemaps.cartocdn.com/dark_all/{{z}}/{{x}}/{{y}}{{r}}.png' 
-                    : 'https://{{s}}.basemaps.cartocdn.com/light_all/{{z}}/{{x}}/{{y}}{{r}}.png';
-                tileLayer.setUrl(url); 
+                // Swap the tile source in place; the layer and its map wiring are kept
+                if (tileLayer) tileLayer.setUrl(isDark ? darkTiles : lightTiles); 
             }}
             
             async function logout() {{ 
                 await fetch('/api/auth/logout', {{method:'POST'}}); 
                 window.location.href = '/login'; 
             }}
-            
-            // Background Loops - FASTER (Every 5 seconds)
-            setInterval(() => {{ if(isOnDuty) sendHeartbeat(); }}, 5000);
-            setInterval(() => {{ if(isOnDuty) dispatch(false); }}, 5000); // false = silent update
         </script>
     </body> 
     </html>
-    """
+"""
+
+def render_pages():
+    PAGES["landing"] = encode_page(LANDING_PAGE_HTML)
+    PAGES["login"] = encode_page(LOGIN_PAGE_HTML)
+    # NGO data is passed to the frontend inline
+    PAGES["customer"] = encode_page(CUSTOMER_PAGE_TEMPLATE.format(ngos_json=NGO_JSON))
+    # The driver page only varies by duty state, so both variants are rendered
+    for is_active in (True, False):
+        PAGES["driver", is_active] = encode_page(
+            DRIVER_PAGE_TEMPLATE.format(db_is_active="true" if is_active else "false")
+        )
+
+
+@app.get("/driver", response_class=HTMLResponse)
+async def driver_app(request: Request):
+    user_phone = session_user(request)
+    
+    # 1. Check if cookie exists
+    if not user_phone: 
+        return RedirectResponse(url="/login?target=/driver")
+    
+    # 2. Check if User actually exists in DB (cached for a few seconds)
+    is_active = await cached_is_active(user_phone)
+    
+    if is_active is None:
+        response = RedirectResponse(url="/login?target=/driver")
+        response.delete_cookie("fresq_user")
+        return response
+    
+    return page_response(request, PAGES["driver", is_active], "private, no-cache")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8005)
\ No newline at end of file
+    # uvicorn picks uvloop and httptools automatically when installed
+    # (pip install "uvicorn[standard]"). Driver positions, fleet versions and
+    # caches live in process memory, so each extra worker (FRESQ_WORKERS) keeps
+    # its own copy; workers also need FRESQ_SECRET_KEY to accept each other's
+    # session cookies. Only multiple workers need the import string; a single
+    # worker serves this already-imported app instead of importing main again.
+    workers = int(os.environ.get("FRESQ_WORKERS", "1"))
+    uvicorn.run(
+        app if workers == 1 else "main:app", host="0.0.0.0", port=8005,
+        workers=workers, log_level="warning",
+    )
@@ -1,4 +1,4 @@
-from typing import List, Literal
+from typing import List, Literal, NamedTuple
 from pydantic import BaseModel
 
 class Location(BaseModel):
@@ -34,4 +34,22 @@ class RoutePoint(BaseModel):
 
 class OptimizationResponse(BaseModel):
     route: List[RoutePoint]
-    total_distance: float
\ No newline at end of file
+    total_distance: float
+
+# Solver inputs. Built from DB rows that are already trusted, so they skip
+# pydantic validation and pickle to the solver process as plain tuples.
+class SolverVehicle(NamedTuple):
+    id: str
+    capacity: int
+    lat: float
+    lon: float
+
+class SolverOrder(NamedTuple):
+    id: str
+    quantity: int
+    pickup_lat: float
+    pickup_lon: float
+    delivery_lat: float
+    delivery_lon: float
+    window_end: int
+    service_time: int
@@ -1,4 +1,5 @@
-import math
+import itertools
+import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
@@ -8,128 +9,128 @@ class VRPSolver:
         self.speed_mpm = 666  
         # Urgency Weight: Prioritize expiring goods
         self.urgency_weight = 100 
+        # Cost of leaving an order unserved, on top of its urgency. Dwarfs any
+        # route cost, so orders are only dropped when they cannot be served
+        # (expired window, over capacity) instead of failing the whole solve.
+        self.drop_penalty = 100_000_000
+        # A single driver with this many orders or fewer is solved exactly,
+        # without building an OR-Tools model
+        self.exact_max_orders = 4
 
-    def haversine_distance(self, lat1, lon1, lat2, lon2):
+    def distance_matrix(self, lat, lon):
         """
-        Calculate the great circle distance between two points 
-        on the earth (specified in decimal degrees) in meters.
+        Distance in meters between every pair of points, as an int64 NxN
+        array. lat/lon are arrays in decimal degrees.
+
+        A fleet covers one city (tens of km), where an equirectangular
+        projection about the mean latitude is within ~0.1% of the great
+        circle distance and needs no per-pair trig.
+
+        Deliveries share a handful of NGO addresses, so distances are only
+        computed between distinct points and then expanded to every node.
         """
         R = 6371000  # Radius of earth in meters
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
+        phi = np.radians(lat)
+        cos_phi0 = np.cos(phi.mean())
+        points, node_point = np.unique(np.stack([lat, lon], axis=1), axis=0, return_inverse=True)
+        node_point = node_point.reshape(-1)
 
-        a = math.sin(dphi / 2)**2 + \
-            math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        y = R * np.radians(points[:, 0])
+        x = R * cos_phi0 * np.radians(points[:, 1])
+        # Symmetric with a zero diagonal: compute the upper triangle and mirror it
+        i, j = np.triu_indices(len(points), k=1)
+        dist = np.zeros((len(points), len(points)), dtype=np.int64)
+        dist[i, j] = np.hypot(x[i] - x[j], y[i] - y[j])
+        dist += dist.T
 
-        return int(R * c)
+        return dist[np.ix_(node_point, node_point)]
 
     def solve_route(self, vehicles, orders):
         """
         Solves the Multi-Vehicle Routing Problem with Load Balancing.
+        Takes SolverVehicle / SolverOrder tuples (see models.py).
         """
         
         if not vehicles or not orders:
             return {}, 0
 
-        # --- 1. BUILD NODE LIST ---
-        nodes = []
-        
-        # A. Vehicle Start Nodes (Indices 0 to len(vehicles)-1)
-        for v in vehicles:
-            nodes.append({
-                "lat": v.start_location.lat, 
-                "lon": v.start_location.lon,
-                "id": v.id,      
-                "type": "start", 
-                "demand": 0,
-                "time_window": (0, 1440), 
-                "priority": 0
-            })
+        # An order larger than every vehicle can never be served; it would only
+        # be dropped after a search, so leave it out of the model entirely
+        max_capacity = max(v.capacity for v in vehicles)
+        orders = [o for o in orders if o.quantity <= max_capacity]
+        if not orders:
+            return {}, 0
 
-        # B. Order Nodes (Pickups and Deliveries)
-        pickups_deliveries = []
-        
-        for order in orders:
-            # Priority Score: Higher if closer to expiry
-            priority_score = max(0, 1440 - order.delivery_window.end)
-            
-            # Pickup Node
-            nodes.append({
-                "lat": order.pickup_location.lat, 
-                "lon": order.pickup_location.lon, 
-                "id": order.id, 
-                "type": "pickup",
-                "demand": order.quantity,
-                "time_window": (order.pickup_window.start, order.pickup_window.end),
-                "priority": priority_score
-            })
-            p_index = len(nodes) - 1
-
-            # Delivery Node
-            nodes.append({
-                "lat": order.delivery_location.lat, 
-                "lon": order.delivery_location.lon, 
-                "id": order.id, 
-                "type": "delivery",
-                "demand": -order.quantity,
-                "time_window": (order.delivery_window.start, order.delivery_window.end),
-                "priority": priority_score
-            })
-            d_index = len(nodes) - 1
+        # --- 1. BUILD NODE ARRAYS ---
+        # A. Vehicle Start Nodes (Indices 0 to num_vehicles-1)
+        # B. Order k: pickup at num_vehicles + 2k, delivery right after it
+        num_vehicles = len(vehicles)
+        num_nodes = num_vehicles + 2 * len(orders)
+        pickup, delivery = slice(num_vehicles, None, 2), slice(num_vehicles + 1, None, 2)
 
-            pickups_deliveries.append((p_index, d_index))
+        node_lat = np.empty(num_nodes)
+        node_lon = np.empty(num_nodes)
+        node_lat[:num_vehicles] = [v.lat for v in vehicles]
+        node_lon[:num_vehicles] = [v.lon for v in vehicles]
+        node_lat[pickup] = [o.pickup_lat for o in orders]
+        node_lon[pickup] = [o.pickup_lon for o in orders]
+        node_lat[delivery] = [o.delivery_lat for o in orders]
+        node_lon[delivery] = [o.delivery_lon for o in orders]
+
+        quantity = np.array([o.quantity for o in orders], dtype=np.int64)
+        node_demand = np.zeros(num_nodes, dtype=np.int64)
+        node_demand[pickup] = quantity
+        node_demand[delivery] = -quantity
+
+        window_end = np.array([o.window_end for o in orders], dtype=np.int64)
+        node_window_end = np.full(num_nodes, 1440, dtype=np.int64)
+        node_window_end[pickup] = node_window_end[delivery] = window_end
+
+        # Priority Score: Higher if closer to expiry. Charged once per order
+        # (on its pickup) if the order is dropped.
+        node_penalty = np.zeros(num_nodes, dtype=np.int64)
+        node_penalty[pickup] = self.drop_penalty + np.maximum(0, 1440 - window_end) * self.urgency_weight
+
+        # Service time is spent at the origin of an arc; start nodes have none
+        node_service = np.zeros(num_nodes, dtype=np.int64)
+        node_service[pickup] = node_service[delivery] = [o.service_time for o in orders]
+
+        # (location_id, order_id, type) per node, labelled once here and only
+        # used to render the routes
+        node_meta = [("DEPOT", None, "start")] * num_vehicles + \
+            [(f"{o.id}_{kind}", o.id, kind) for o in orders for kind in ("pickup", "delivery")]
+        pickups_deliveries = [(p, p + 1) for p in range(num_vehicles, num_nodes, 2)]
+
+        # Every arc the search can evaluate is precomputed once here
+        dist = self.distance_matrix(node_lat, node_lon)
+
+        # Travel + service time at the origin
+        time_matrix = (dist // self.speed_mpm + node_service[:, None]).tolist()
+        dist_matrix = dist.tolist()
+
+        if num_vehicles == 1 and len(orders) <= self.exact_max_orders:
+            return self.solve_single(
+                vehicles[0], node_meta, pickups_deliveries, node_demand.tolist(),
+                node_window_end.tolist(), node_penalty.tolist(), time_matrix, dist_matrix
+            )
 
         # --- 2. CONFIG ROUTING MODEL ---
-        num_vehicles = len(vehicles)
         starts = [i for i in range(num_vehicles)]
         ends = [i for i in range(num_vehicles)]
 
-        manager = pywrapcp.RoutingIndexManager(len(nodes), num_vehicles, starts, ends)
+        manager = pywrapcp.RoutingIndexManager(num_nodes, num_vehicles, starts, ends)
         routing = pywrapcp.RoutingModel(manager)
 
         # --- 3. CALLBACKS ---
-        
-        # A. Cost Callback (Distance - Urgency Reward)
-        def cost_callback(from_index, to_index):
-            fn = manager.IndexToNode(from_index)
-            tn = manager.IndexToNode(to_index)
-            
-            dist = self.haversine_distance(
-                nodes[fn]["lat"], nodes[fn]["lon"], 
-                nodes[tn]["lat"], nodes[tn]["lon"]
-            )
-            
-            # Reduce effective cost for urgent nodes to encourage visiting them
-            urgency_discount = nodes[tn]["priority"] * self.urgency_weight
-            return max(0, dist - urgency_discount)
-
-        transit_callback_index = routing.RegisterTransitCallback(cost_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-        # B. Pure Distance Callback
-        def distance_callback(from_index, to_index):
-            fn = manager.IndexToNode(from_index)
-            tn = manager.IndexToNode(to_index)
-            return self.haversine_distance(
-                nodes[fn]["lat"], nodes[fn]["lon"], 
-                nodes[tn]["lat"], nodes[tn]["lon"]
-            )
-
-        dist_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.AddDimension(dist_callback_index, 0, 3000000, True, "Distance")
+        # The matrices are handed to OR-Tools as-is, so the search never calls
+        # back into Python.
+        # A. Arc cost is the plain distance; urgency is priced by the
+        # disjunction penalties below
+        dist_callback_index = routing.RegisterTransitMatrix(dist_matrix)
+        routing.SetArcCostEvaluatorOfAllVehicles(dist_callback_index)
 
-        # C. Time Callback (Travel + Service)
-        def time_callback(from_index, to_index):
-            dist = distance_callback(from_index, to_index)
-            travel_time = int(dist / self.speed_mpm)
-            
-            fn = manager.IndexToNode(from_index)
-            service_time = 10 if nodes[fn]["type"] != "start" else 0 
-            return travel_time + service_time
-
-        time_callback_index = routing.RegisterTransitCallback(time_callback)
+        # B. Time Callback (Travel + Service)
+        time_callback_index = routing.RegisterTransitMatrix(time_matrix)
         
         # Add Time Dimension with GLOBAL SPAN COST
         routing.AddDimension(
@@ -146,11 +147,13 @@ class VRPSolver:
         # This effectively forces load balancing.
         time_dimension.SetGlobalSpanCostCoefficient(500)
 
-        # D. Capacity Callback
-        def demand_callback(from_index):
-            return nodes[manager.IndexToNode(from_index)]["demand"]
+        # Every driver leaves now (minute 0), so arrival times read as minutes
+        # from now and each stop's cumul is a single value in the solution
+        for vehicle_idx in range(num_vehicles):
+            time_dimension.CumulVar(routing.Start(vehicle_idx)).SetValue(0)
 
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        # C. Capacity Callback
+        demand_callback_index = routing.RegisterUnaryTransitVector(node_demand.tolist())
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index, 0, [v.capacity for v in vehicles], True, "Capacity"
         )
@@ -161,18 +164,22 @@ class VRPSolver:
             d_idx = manager.NodeToIndex(d)
             
             routing.AddPickupAndDelivery(p_idx, d_idx)
+            # The pair is performed together or not at all; the penalty sits on the pickup
+            routing.AddDisjunction([p_idx], int(node_penalty[p]))
+            routing.AddDisjunction([d_idx], 0)
             routing.solver().Add(routing.VehicleVar(p_idx) == routing.VehicleVar(d_idx))
             routing.solver().Add(time_dimension.CumulVar(p_idx) <= time_dimension.CumulVar(d_idx))
 
-            d_node = nodes[d]
-            time_dimension.CumulVar(d_idx).SetRange(
-                int(d_node["time_window"][0]), 
-                int(d_node["time_window"][1])
-            )
+            time_dimension.CumulVar(d_idx).SetRange(0, int(node_window_end[d]))
 
         # --- 5. SOLVE ---
         search_params = pywrapcp.DefaultRoutingSearchParameters()
         search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        # Greedy descent stops on its own at a local optimum (well under a second
+        # for a typical fleet). Guided local search never stops early: it always
+        # burns the whole limit, and at a 2 s cap it was no better on average.
+        search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GREEDY_DESCENT
+        # Hard wall clock for large fleets
         search_params.time_limit.seconds = 5
         
         solution = routing.SolveWithParameters(search_params)
@@ -188,20 +195,19 @@ class VRPSolver:
                 route_steps = []
                 
                 while not routing.IsEnd(index):
-                    node = nodes[manager.IndexToNode(index)]
-                    arrival = solution.Min(time_dimension.CumulVar(index))
-                    
-                    loc_id = "DEPOT" if node["type"] == "start" else f"{node['id']}_{node['type']}"
+                    loc_id, order_id, node_type = node_meta[manager.IndexToNode(index)]
+                    arrival = solution.Value(time_dimension.CumulVar(index))
                     
                     route_steps.append({
                         "location_id": loc_id,
-                        "type": node["type"],
+                        "order_id": order_id,
+                        "type": node_type,
                         "arrival_time": arrival
                     })
                     
                     prev = index
                     index = solution.Value(routing.NextVar(index))
-                    total_dist_meters += distance_callback(prev, index)
+                    total_dist_meters += dist_matrix[manager.IndexToNode(prev)][manager.IndexToNode(index)]
                 
                 # Check if route has actual work
                 if len(route_steps) > 1:
@@ -209,4 +215,61 @@ class VRPSolver:
                 else:
                      routes[driver_id] = []
         
-        return routes, total_dist_meters
\ No newline at end of file
+        return routes, total_dist_meters
+
+    def solve_single(self, vehicle, node_meta, pickups_deliveries, demand,
+                     window_end, penalty, time_matrix, dist_matrix):
+        """
+        Exact solve for one vehicle (start node 0) and a handful of orders:
+        tries every pickup/delivery order that respects capacity, the 1440
+        minute day and the delivery windows, and keeps the cheapest under the
+        same objective as the OR-Tools model (distance + 500 x route time +
+        penalties of dropped orders). Returns the same (routes,
+        total_dist_meters) shape as solve_route.
+        """
+        delivery_of = dict(pickups_deliveries)
+        best = None
+
+        def extend(node, seq, todo, load, t, cost):
+            nonlocal best
+            if not todo:
+                end = t + time_matrix[node][0]
+                total = cost + dist_matrix[node][0] + 500 * end
+                if end <= 1440 and (best is None or total < best[0]):
+                    best = (total, seq)
+                return
+            for nxt in todo:
+                arrival = t + time_matrix[node][nxt]
+                if arrival > 1440 or load + demand[nxt] > vehicle.capacity:
+                    continue
+                if nxt in delivery_of:
+                    rest = (todo - {nxt}) | {delivery_of[nxt]}
+                elif arrival <= window_end[nxt]:
+                    rest = todo - {nxt}
+                else:
+                    continue
+                extend(nxt, seq + [(nxt, arrival)], rest, load + demand[nxt],
+                       arrival, cost + dist_matrix[node][nxt])
+
+        # A drop costs more than any route, so the fewest drops that leave a
+        # feasible route win; only larger drop sets are tried if none does.
+        pickups = list(delivery_of)
+        for num_dropped in range(len(pickups) + 1):
+            for dropped in itertools.combinations(pickups, num_dropped):
+                extend(0, [(0, 0)], frozenset(delivery_of).difference(dropped), 0, 0,
+                       sum(penalty[p] for p in dropped))
+            if best is not None:
+                break
+
+        route_steps = []
+        for node, arrival in best[1]:
+            loc_id, order_id, node_type = node_meta[node]
+            route_steps.append({
+                "location_id": loc_id,
+                "order_id": order_id,
+                "type": node_type,
+                "arrival_time": arrival
+            })
+        path = [node for node, _ in best[1]] + [0]
+        total_dist_meters = sum(dist_matrix[a][b] for a, b in zip(path, path[1:]))
+        return {vehicle.id: route_steps if len(route_steps) > 1 else []}, total_dist_meters
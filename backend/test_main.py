@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+class OrdersETagTest(unittest.TestCase):
+    def setUp(self):
+        # main opens fresq.db relative to the working directory; start each test on an empty one
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_each_encoding_has_its_own_etag(self):
+        for i in range(10):
+            res = self.client.post("/api/create_order", json={
+                "pickup_lat": 25.18, "pickup_lon": 75.84, "quantity": 5,
+                "details": f"order {i}", "expiry_hours": 4,
+            })
+            self.assertEqual(res.status_code, 200)
+
+        gz = self.client.get("/api/orders", headers={"Accept-Encoding": "gzip"})
+        plain = self.client.get("/api/orders", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(gz.headers["content-encoding"], "gzip")
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertEqual(gz.json(), plain.json())
+        self.assertNotEqual(gz.headers["etag"], plain.headers["etag"])
+        for res in (gz, plain):
+            self.assertIn("Accept-Encoding", res.headers["vary"])
+
+        def revalidate(encoding, etag):
+            return self.client.get("/api/orders", headers={"Accept-Encoding": encoding, "If-None-Match": etag})
+
+        self.assertEqual(revalidate("gzip", gz.headers["etag"]).status_code, 304)
+        self.assertEqual(revalidate("identity", plain.headers["etag"]).status_code, 304)
+        self.assertEqual(revalidate("identity", gz.headers["etag"]).status_code, 200)
+        self.assertEqual(revalidate("gzip", plain.headers["etag"]).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()